@@ -1,13 +1,88 @@
 from bs4 import BeautifulSoup
+import lxml.etree
+import lxml.html
 import requests
 import pytest
 
 from .exceptions import ArticleNotFound
-from .html_tools import remove_buzz_attrs, remove_buzz_tags, remove_all_tags
+from .html_tools import (
+    DEFAULT_BLACKLIST_TAGS,
+    remove_all_tags,
+    remove_buzz_attrs,
+    remove_buzz_tags,
+)
+
+# Содержимое этих тегов не является текстом статьи, BeautifulSoup
+# не включает его в get_text(), а lxml в text_content() — включает
+NON_TEXT_TAGS = ['style', 'template']
+
+
+def _has_class_xpath(tag, class_name):
+    return (
+        f"{tag}[contains(concat(' ', normalize-space(@class), ' '), "
+        f"' {class_name} ')]"
+    )
+
+
+ARTICLE_XPATH = f"//{_has_class_xpath('div', 'layout-article')}"
+BUZZ_BLOCKS_XPATH = ' | '.join(
+    [
+        f".//{_has_class_xpath('*', 'article-disclaimer')}",
+        f".//{_has_class_xpath('footer', 'article-footer')}",
+        './/aside',
+        *(f'.//{tag}' for tag in DEFAULT_BLACKLIST_TAGS),
+        *(f'.//{tag}' for tag in NON_TEXT_TAGS),
+    ]
+)
+
+
+def _decode_html(html, encoding):
+    """Декодирует байты кодеками Python: libxml2 знает не все имена
+    кодировок, которые принимает Python (euc_jp, koi8_r, mac-cyrillic).
+    Без encoding или с неизвестной кодировкой байты возвращаются как есть,
+    и парсер сам определяет кодировку по meta charset."""
+    if not isinstance(html, bytes) or not encoding:
+        return html
+
+    try:
+        return html.decode(encoding, errors='replace')
+    except LookupError:
+        return html
+
+
+def _build_lxml_tree(html):
+    if isinstance(html, str):
+        # lxml не принимает строки с XML-декларацией кодировки
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+        return lxml.html.document_fromstring(
+            html.encode('utf-8'), parser=parser
+        )
 
+    return lxml.html.document_fromstring(html)
 
-def sanitize(html, plaintext=False):
-    soup = BeautifulSoup(html, 'lxml')
+
+def _sanitize_plaintext(html, encoding=None):
+    """Быстрый путь для plaintext: lxml извлекает текст без построения
+    дерева BeautifulSoup."""
+    try:
+        tree = _build_lxml_tree(_decode_html(html, encoding))
+    except lxml.etree.ParserError:
+        raise ArticleNotFound()
+
+    articles = tree.xpath(ARTICLE_XPATH)
+
+    if len(articles) != 1:
+        raise ArticleNotFound()
+
+    article = articles[0]
+    for el in article.xpath(BUZZ_BLOCKS_XPATH):
+        el.drop_tree()
+
+    return article.text_content().strip()
+
+
+def _extract_article_soup(html, encoding=None):
+    soup = BeautifulSoup(_decode_html(html, encoding), 'lxml')
     articles = soup.select('div.layout-article')
 
     if len(articles) != 1:
@@ -27,12 +102,16 @@ def sanitize(html, plaintext=False):
     remove_buzz_attrs(article)
     remove_buzz_tags(article)
 
-    if not plaintext:
-        text = article.prettify()
-    else:
-        remove_all_tags(article)
-        text = article.get_text()
-    return text.strip()
+    return article
+
+
+def sanitize(html, plaintext=False, encoding=None):
+    """html может быть строкой или байтами; для байтов encoding задаёт
+    кодировку из HTTP-заголовка, без неё она берётся из meta charset."""
+    if plaintext:
+        return _sanitize_plaintext(html, encoding)
+
+    return _extract_article_soup(html, encoding).prettify().strip()
 
 
 def test_sanitize():
@@ -66,3 +145,73 @@ def test_sanitize_wrong_url():
     resp.raise_for_status()
     with pytest.raises(ArticleNotFound):
         sanitize(resp.text)
+
+
+def test_sanitize_bytes_with_header_encoding():
+    html = (
+        '<html><head><title>Статья</title></head><body>'
+        '<div class="layout-article"><p>Заряженные слова</p></div>'
+        '</body></html>'
+    )
+    encodings = [
+        'utf-8',
+        'windows-1251',
+        # Имена, которые понимает Python, но не libxml2
+        'euc_jp',
+        'utf_8',
+        'koi8_r',
+        'IBM855',
+        'mac-cyrillic',
+    ]
+    for encoding in encodings:
+        html_bytes = html.encode(encoding)
+
+        assert (
+            sanitize(html_bytes, plaintext=True, encoding=encoding)
+            == 'Заряженные слова'
+        )
+        assert 'Заряженные слова' in sanitize(html_bytes, encoding=encoding)
+
+    meta_html = html.replace('<head>', '<head><meta charset="utf-8">')
+    assert (
+        sanitize(
+            meta_html.encode('utf-8'),
+            plaintext=True,
+            encoding='unknown-charset',
+        )
+        == 'Заряженные слова'
+    )
+
+    xml_html = f'<?xml version="1.0" encoding="windows-1251"?>{html}'
+    assert sanitize(xml_html, plaintext=True) == 'Заряженные слова'
+
+
+def test_sanitize_plaintext_matches_soup():
+    html = """
+        <html><head><style>body {}</style></head><body>
+        <div class="layout-article main">
+            <h1>Заголовок &amp; подзаголовок</h1>
+            <p class="lead">Первый <a href="/link">абзац</a> текста.<style>
+                .a{}
+            </style>Второй<script>var a = 1;</script> абзац.</p>
+            <div class="article-disclaimer">Дисклеймер</div>хвост
+            <time>12:00</time>
+            <aside>Реклама <script>s()</script></aside>
+            <template><p>Шаблон</p></template>
+            <!-- комментарий -->
+            <span>Ещё <b>текст</b></span>
+            <footer class="article-footer">Подвал</footer>
+        </div>
+        <div class="layout-article-other">Чужой блок</div>
+        </body></html>
+    """
+    article = _extract_article_soup(html)
+    remove_all_tags(article)
+    soup_plaintext = article.get_text().strip()
+
+    # BeautifulSoup схлопывает пробельные отступы между тегами, а lxml
+    # их сохраняет, поэтому сравниваем последовательности слов
+    assert sanitize(html, plaintext=True).split() == soup_plaintext.split()
+    assert 'a{}' not in soup_plaintext
+    assert 'Шаблон' not in soup_plaintext
+    assert 'Дисклеймер' not in soup_plaintext
@@ -1,25 +1,49 @@
 import asyncio
-from contextlib import contextmanager
+import importlib.metadata
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from contextlib import suppress
 from dataclasses import dataclass
+from functools import partial
 from enum import Enum
-from time import perf_counter
 from typing import Optional
 
-import aiofiles
 import aiohttp
 import anyio
 import async_timeout
 import pymorphy2
 import pytest
 
+try:
+    import aiodns
+except ImportError:
+    aiodns = None
+
 from adapters.inosmi_ru import sanitize
 from adapters.exceptions import ArticleNotFound
-from text_tools import calculate_yellow_press_rate, split_by_words
+from text_tools import (
+    calculate_yellow_press_rate,
+    clear_normalization_cache,
+    split_by_words_sync,
+)
 
 
 NEGATIVE_WORDS_PATH = 'charged_dict/negative_words.txt'
 POSITIVE_WORDS_PATH = 'charged_dict/positive_words.txt'
+CHARGED_WORDS_CACHE_PATH = 'charged_dict/_cache.pkl'
+# Увеличивать при любом изменении нормализации слов в text_tools
+CHARGED_WORDS_CACHE_VERSION = 1
 TIMEOUT = 3
+FETCH_TIMEOUT = 3
+CONNECT_TIMEOUT = 1
+CONNECTIONS_LIMIT = 100
+DNS_CACHE_TTL = 300
+CHUNK_WORDS_COUNT = 500
 
 
 class ProcessingStatus(Enum):
@@ -29,7 +53,7 @@ class ProcessingStatus(Enum):
     TIMEOUT_ERROR = 'TIMEOUT_ERROR'
 
 
-@dataclass
+@dataclass(slots=True)
 class ArticleAnalyseStats:
     url: str
     status: str
@@ -37,41 +61,162 @@ class ArticleAnalyseStats:
     words_count: Optional[int] = None
 
 
-@contextmanager
-def timeit() -> float:
-    start = perf_counter()
-    yield lambda: perf_counter() - start
+_worker_morph = None
+
+
+def _init_worker():
+    """Создаёт по одному MorphAnalyzer на каждый процесс пула."""
+    global _worker_morph
+    _worker_morph = pymorphy2.MorphAnalyzer()
+
+
+def _split_article_text(text):
+    return split_by_words_sync(_worker_morph, text)
+
+
+def _split_into_chunks(text, chunk_size=CHUNK_WORDS_COUNT):
+    """Делит текст на части по chunk_size слов. Части разбираются в пуле
+    параллельно, а по таймауту ещё не начатые части отменяются, так что
+    воркеры не заняты разбором статьи, которая уже не нужна."""
+    words = text.split()
+    chunks = []
+    for start in range(0, len(words), chunk_size):
+        end = start + chunk_size
+        chunks.append(' '.join(words[start:end]))
+
+    return chunks
+
+
+def create_process_pool():
+    """Воркеры запускаются через forkserver: к моменту первой задачи в
+    сервере уже работают потоки aiohttp, и fork от такого процесса может
+    зависнуть."""
+    return ProcessPoolExecutor(
+        mp_context=multiprocessing.get_context('forkserver'),
+        initializer=_init_worker,
+    )
+
+
+def create_session():
+    """Использует асинхронный DNS-резолвер, если установлен aiodns."""
+    resolver = aiohttp.AsyncResolver() if aiodns else None
+    connector = aiohttp.TCPConnector(
+        limit=CONNECTIONS_LIMIT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        resolver=resolver,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=FETCH_TIMEOUT,
+        connect=CONNECT_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
 
 
 async def fetch(session, url):
+    """Возвращает сырые байты страницы и кодировку из HTTP-заголовка или
+    None: декодированием, в том числе по meta charset, занимается парсер
+    в процессе пула, а не event loop."""
     async with session.get(url) as response:
         response.raise_for_status()
-        return await response.text()
+        html = await response.read()
+        return html, response.charset
+
+
+def extract_file_content(filename):
+    with open(filename, encoding='utf-8') as file:
+        return file.read()
+
 
+def gather_charged_words(morph):
+    negative_text = extract_file_content(NEGATIVE_WORDS_PATH)
+    negative_words = split_by_words_sync(morph, negative_text)
 
-async def extract_file_content(filename):
-    async with aiofiles.open(filename, 'r') as file:
-        return await file.read()
+    positive_text = extract_file_content(POSITIVE_WORDS_PATH)
+    positive_words = split_by_words_sync(morph, positive_text)
 
+    return frozenset(map(sys.intern, (*negative_words, *positive_words)))
 
-async def gather_charged_words(morph):
-    negative_text = await extract_file_content(NEGATIVE_WORDS_PATH)
-    negative_words = await split_by_words(morph, negative_text)
 
-    positive_text = await extract_file_content(POSITIVE_WORDS_PATH)
-    positive_words = await split_by_words(morph, positive_text)
+def _get_package_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def _get_charged_words_cache_key():
+    return (
+        CHARGED_WORDS_CACHE_VERSION,
+        _get_package_version('pymorphy2'),
+        _get_package_version('pymorphy2-dicts-ru'),
+        os.path.getmtime(NEGATIVE_WORDS_PATH),
+        os.path.getmtime(POSITIVE_WORDS_PATH),
+    )
+
+
+def _save_charged_words_cache(cache_key, charged_words):
+    """Кеш необязателен: если каталог недоступен для записи, сервер просто
+    стартует без него. Файл пишется целиком во временный и затем
+    подменяется, чтобы параллельный запуск не прочитал его наполовину."""
+    cache_dir = os.path.dirname(CHARGED_WORDS_CACHE_PATH) or '.'
+    try:
+        file = tempfile.NamedTemporaryFile('wb', dir=cache_dir, delete=False)
+    except OSError:
+        return
+
+    try:
+        with file:
+            pickle.dump((cache_key, charged_words), file)
+        os.replace(file.name, CHARGED_WORDS_CACHE_PATH)
+    except OSError:
+        with suppress(OSError):
+            os.remove(file.name)
 
-    return [*negative_words, *positive_words]
 
+def load_charged_words():
+    """Берёт заряженные слова из кеша, если словари, версия pymorphy2 и
+    нормализации не менялись с момента его создания, иначе заново
+    разбирает словари и обновляет кеш."""
+    cache_key = _get_charged_words_cache_key()
 
-async def process_article(
-    session, morph, charged_words, url, results, timeout=TIMEOUT
-):
     try:
-        article_html = await fetch(session, url)
-        article_text = sanitize(article_html, plaintext=True)
+        with open(CHARGED_WORDS_CACHE_PATH, 'rb') as file:
+            cached_key, charged_words = pickle.load(file)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+    else:
+        if cached_key == cache_key:
+            return frozenset(map(sys.intern, charged_words))
+
+    morph = pymorphy2.MorphAnalyzer()
+    charged_words = gather_charged_words(morph)
+    clear_normalization_cache()
+    _save_charged_words_cache(cache_key, charged_words)
+
+    return charged_words
+
+
+async def process_article(session, pool, charged_words, url, timeout=TIMEOUT):
+    loop = asyncio.get_running_loop()
+    try:
+        article_html, encoding = await fetch(session, url)
+        article_text = await loop.run_in_executor(
+            pool,
+            partial(sanitize, plaintext=True, encoding=encoding),
+            article_html,
+        )
         async with async_timeout.timeout(timeout):
-            article_words = await split_by_words(morph, article_text)
+            chunks_words = await asyncio.gather(
+                *(
+                    loop.run_in_executor(pool, _split_article_text, chunk)
+                    for chunk in _split_into_chunks(article_text)
+                )
+            )
+            # Слова приходят из пула распакованными из pickle, поэтому
+            # интернируем их здесь, где идёт сравнение с charged_words
+            article_words = list(
+                map(sys.intern, chain.from_iterable(chunks_words))
+            )
 
     except aiohttp.ClientError:
         stats = ArticleAnalyseStats(url, ProcessingStatus.FETCH_ERROR.value)
@@ -88,26 +233,22 @@ async def process_article(
             url, ProcessingStatus.OK.value, rate, len(article_words)
         )
 
-    finally:
-        results.append(stats)
+    return stats
 
 
-async def process_articles(urls):
-    morph = pymorphy2.MorphAnalyzer()
-    charged_words = await gather_charged_words(morph)
-    results = []
+async def process_articles(urls, charged_words, pool, session):
+    """Обрабатывает статьи в одной группе задач: неожиданная ошибка в
+    одной из них отменяет остальные, а не оставляет их работать в фоне."""
+    results = [None] * len(urls)
 
-    async with aiohttp.ClientSession() as session:
-        async with anyio.create_task_group() as tg:
-            for url in urls:
-                tg.start_soon(
-                    process_article,
-                    session,
-                    morph,
-                    charged_words,
-                    url,
-                    results,
-                )
+    async def process_article_at(index, url):
+        results[index] = await process_article(
+            session, pool, charged_words, url
+        )
+
+    async with anyio.create_task_group() as tg:
+        for index, url in enumerate(urls):
+            tg.start_soon(process_article_at, index, url)
 
     return results
 
@@ -115,34 +256,189 @@ async def process_articles(urls):
 @pytest.mark.asyncio
 async def test_process_article():
     morph = pymorphy2.MorphAnalyzer()
-    charged_words = await gather_charged_words(morph)
-
-    async with aiohttp.ClientSession() as session:
-        url = 'https://lenta.ru/brief/2021/08/26/afg_terror/'
-        results = []
-        await process_article(session, morph, charged_words, url, results)
-        [stats] = results
-
-        assert stats == ArticleAnalyseStats(
-            url,
-            ProcessingStatus.PARSE_ERROR.value,
+    charged_words = gather_charged_words(morph)
+
+    with create_process_pool() as pool:
+        async with create_session() as session:
+            url = 'https://lenta.ru/brief/2021/08/26/afg_terror/'
+            stats = await process_article(session, pool, charged_words, url)
+
+            assert stats == ArticleAnalyseStats(
+                url,
+                ProcessingStatus.PARSE_ERROR.value,
+            )
+
+            url = 'https://inosmi.ru/20220303/kitay-shos-253268048.html'
+            stats = await process_article(
+                session, pool, charged_words, url, 0.2
+            )
+            assert stats == ArticleAnalyseStats(
+                url,
+                ProcessingStatus.TIMEOUT_ERROR.value,
+            )
+
+            url = 'random_link'
+            stats = await process_article(session, pool, charged_words, url)
+
+            assert stats == ArticleAnalyseStats(
+                url,
+                ProcessingStatus.FETCH_ERROR.value,
+            )
+
+
+async def test_process_articles_cancels_siblings_on_error(monkeypatch):
+    cancelled_urls = []
+
+    async def fake_process_article(session, pool, charged_words, url):
+        if url == 'broken':
+            raise RuntimeError()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled_urls.append(url)
+            raise
+
+    monkeypatch.setattr(
+        sys.modules[__name__], 'process_article', fake_process_article
+    )
+
+    # anyio 3 пробрасывает исключение как есть, anyio 4 — в ExceptionGroup
+    with pytest.raises(Exception):
+        await process_articles(['slow', 'broken'], frozenset(), None, None)
+
+    assert cancelled_urls == ['slow']
+
+
+async def test_fetch_uses_header_encoding():
+    import aiohttp.test_utils
+    import aiohttp.web
+
+    html = (
+        '<html><head>{meta}</head><body><div class="layout-article">'
+        '<p>Заряженные слова</p>'
+        '</div></body></html>'
+    )
+
+    async def handle_header_charset(request):
+        encoding = request.match_info['encoding']
+        return aiohttp.web.Response(
+            body=html.format(meta='').encode(encoding),
+            content_type='text/html',
+            charset=encoding,
         )
 
-        url = 'https://inosmi.ru/20220303/kitay-shos-253268048.html'
-        results = []
-        await process_article(session, morph, charged_words, url, results, 0.2)
-        [stats] = results
-        assert stats == ArticleAnalyseStats(
-            url,
-            ProcessingStatus.TIMEOUT_ERROR.value,
+    async def handle_meta_charset(request):
+        meta = '<meta charset="windows-1251">'
+        return aiohttp.web.Response(
+            body=html.format(meta=meta).encode('windows-1251'),
+            content_type='text/html',
         )
 
-        url = 'random_link'
-        results = []
-        await process_article(session, morph, charged_words, url, results)
-        [stats] = results
+    app = aiohttp.web.Application()
+    app.router.add_get('/header/{encoding}', handle_header_charset)
+    app.router.add_get('/meta', handle_meta_charset)
+
+    async with aiohttp.test_utils.TestServer(app) as server:
+        async with create_session() as session:
+            urls = [
+                server.make_url('/header/utf-8'),
+                server.make_url('/header/windows-1251'),
+                server.make_url('/header/euc-jp'),
+                server.make_url('/meta'),
+            ]
+            for url in urls:
+                article_html, article_encoding = await fetch(session, url)
+                article_text = sanitize(
+                    article_html, plaintext=True, encoding=article_encoding
+                )
 
-        assert stats == ArticleAnalyseStats(
-            url,
-            ProcessingStatus.FETCH_ERROR.value,
-        )
+                assert article_text == 'Заряженные слова'
+
+
+def test_split_into_chunks():
+    assert _split_into_chunks('') == []
+    assert _split_into_chunks('  \n ') == []
+
+    short_text = 'раз два\nтри'
+    assert _split_into_chunks(short_text) == ['раз два три']
+
+    words = [f'слово{number}' for number in range(CHUNK_WORDS_COUNT * 2 + 1)]
+    text = '\n'.join(words)
+
+    chunks = _split_into_chunks(text)
+    assert [len(chunk.split()) for chunk in chunks] == [
+        CHUNK_WORDS_COUNT,
+        CHUNK_WORDS_COUNT,
+        1,
+    ]
+    assert list(chain.from_iterable(map(str.split, chunks))) == words
+
+    chunks = _split_into_chunks(text, 7)
+    assert all(len(chunk.split()) <= 7 for chunk in chunks)
+    assert list(chain.from_iterable(map(str.split, chunks))) == words
+
+
+def _use_charged_words_tmp_paths(monkeypatch, tmp_path):
+    module = sys.modules[__name__]
+    negative_path = tmp_path / 'negative_words.txt'
+    positive_path = tmp_path / 'positive_words.txt'
+    negative_path.write_text('плохой', encoding='utf-8')
+    positive_path.write_text('хороший', encoding='utf-8')
+    monkeypatch.setattr(module, 'NEGATIVE_WORDS_PATH', str(negative_path))
+    monkeypatch.setattr(module, 'POSITIVE_WORDS_PATH', str(positive_path))
+    monkeypatch.setattr(
+        module, 'CHARGED_WORDS_CACHE_PATH', str(tmp_path / '_cache.pkl')
+    )
+
+    gathered = []
+
+    def fake_gather_charged_words(morph):
+        gathered.append(morph)
+        return frozenset({'плохой', 'хороший'})
+
+    monkeypatch.setattr(pymorphy2, 'MorphAnalyzer', object)
+    monkeypatch.setattr(
+        module, 'gather_charged_words', fake_gather_charged_words
+    )
+    return gathered
+
+
+def test_load_charged_words_cache(monkeypatch, tmp_path):
+    gathered = _use_charged_words_tmp_paths(monkeypatch, tmp_path)
+    module = sys.modules[__name__]
+
+    assert load_charged_words() == {'плохой', 'хороший'}
+    assert len(gathered) == 1
+    assert os.path.exists(CHARGED_WORDS_CACHE_PATH)
+
+    assert load_charged_words() == {'плохой', 'хороший'}
+    assert len(gathered) == 1
+
+    os.utime(NEGATIVE_WORDS_PATH, (0, 0))
+    load_charged_words()
+    assert len(gathered) == 2
+
+    monkeypatch.setattr(
+        module, 'CHARGED_WORDS_CACHE_VERSION', CHARGED_WORDS_CACHE_VERSION + 1
+    )
+    load_charged_words()
+    assert len(gathered) == 3
+
+    load_charged_words()
+    assert len(gathered) == 3
+
+
+def test_load_charged_words_unwritable_cache(monkeypatch, tmp_path):
+    gathered = _use_charged_words_tmp_paths(monkeypatch, tmp_path)
+    monkeypatch.setattr(
+        sys.modules[__name__],
+        'CHARGED_WORDS_CACHE_PATH',
+        str(tmp_path / 'missing_dir' / '_cache.pkl'),
+    )
+
+    assert load_charged_words() == {'плохой', 'хороший'}
+    assert len(gathered) == 1
+    assert sorted(os.listdir(tmp_path)) == [
+        'negative_words.txt',
+        'positive_words.txt',
+    ]
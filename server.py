@@ -1,10 +1,17 @@
 from typing import Optional
-from dataclasses import asdict
 
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 
-from articles_handlers import process_articles
+from articles_handlers import (
+    create_process_pool,
+    create_session,
+    load_charged_words,
+    process_articles,
+)
+
+
+MAX_URLS_COUNT = 10
 
 
 class TooManyUrlsException(Exception):
@@ -14,6 +21,19 @@ class TooManyUrlsException(Exception):
 app = FastAPI()
 
 
+@app.on_event('startup')
+async def load_resources():
+    app.state.charged_words = load_charged_words()
+    app.state.pool = create_process_pool()
+    app.state.session = create_session()
+
+
+@app.on_event('shutdown')
+async def release_resources():
+    await app.state.session.close()
+    app.state.pool.shutdown()
+
+
 @app.exception_handler(TooManyUrlsException)
 async def exception_handler(request: Request, exc: TooManyUrlsException):
     return JSONResponse(
@@ -24,9 +44,24 @@ async def exception_handler(request: Request, exc: TooManyUrlsException):
 
 @app.get('/')
 async def read_root(urls: Optional[str]):
-    urls = await process_articles(urls.split(','))
-    if len(urls) > 10:
+    urls = urls.split(',')
+    if len(urls) > MAX_URLS_COUNT:
         raise TooManyUrlsException()
 
-    urls_formatted = [asdict(url) for url in urls]
-    return {"urls": urls_formatted}
+    articles_stats = await process_articles(
+        urls,
+        app.state.charged_words,
+        app.state.pool,
+        app.state.session,
+    )
+
+    urls_formatted = [
+        {
+            'url': stats.url,
+            'status': stats.status,
+            'rate': stats.rate,
+            'words_count': stats.words_count,
+        }
+        for stats in articles_stats
+    ]
+    return JSONResponse(content={'urls': urls_formatted})
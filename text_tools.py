@@ -1,10 +1,15 @@
 import asyncio
 import pymorphy2
+import re
 import string
+from functools import lru_cache
 
 import pytest
 
 
+WORD_PATTERN = re.compile(r'\S+')
+
+
 def _clean_word(word):
     word = word.replace('«', '').replace('»', '').replace('…', '')
     # FIXME какие еще знаки пунктуации часто встречаются ?
@@ -12,15 +17,37 @@ def _clean_word(word):
     return word
 
 
+@lru_cache(maxsize=200_000)
+def _normalize_word(morph, word):
+    """Кеширует нормальные формы: частые слова повторяются между статьями."""
+    return morph.parse(word)[0].normal_form
+
+
+def clear_normalization_cache():
+    """Сбрасывает кеш нормальных форм, а вместе с ним и ссылку на
+    MorphAnalyzer, которая входит в ключ кеша."""
+    _normalize_word.cache_clear()
+
+
+def _iter_normalized_words(morph, text):
+    for match in WORD_PATTERN.finditer(text):
+        cleaned_word = _clean_word(match.group())
+        normalized_word = _normalize_word(morph, cleaned_word)
+        if len(normalized_word) > 2 or normalized_word == 'не':
+            yield normalized_word
+
+
+def split_by_words_sync(morph, text):
+    """Синхронный вариант split_by_words для запуска в пуле процессов."""
+    return list(_iter_normalized_words(morph, text))
+
+
 async def split_by_words(morph, text):
     """Учитывает знаки пунктуации, регистр и словоформы,
     выкидывает предлоги."""
     words = []
-    for word in text.split():
-        cleaned_word = _clean_word(word)
-        normalized_word = morph.parse(cleaned_word)[0].normal_form
-        if len(normalized_word) > 2 or normalized_word == 'не':
-            words.append(normalized_word)
+    for normalized_word in _iter_normalized_words(morph, text):
+        words.append(normalized_word)
         await asyncio.sleep(0)
 
     return words
@@ -48,29 +75,36 @@ async def test_split_by_words():
         'начало',
     ]
 
+    assert split_by_words_sync(morph, 'Во-первых, он хочет, чтобы') == [
+        'во-первых',
+        'хотеть',
+        'чтобы',
+    ]
+
 
 def calculate_yellow_press_rate(article_words, charged_words):
-    """Расчитывает желтушность текста, принимает список "заряженных" слов и
-    ищет их внутри article_words."""
+    """Расчитывает желтушность текста, принимает множество "заряженных" слов
+    и ищет их внутри article_words."""
 
     if not article_words:
         return 0.0
 
-    found_charged_words = [
-        word for word in article_words if word in set(charged_words)
-    ]
+    found_charged_words_count = sum(
+        map(charged_words.__contains__, article_words)
+    )
 
-    score = len(found_charged_words) / len(article_words) * 100
+    score = found_charged_words_count / len(article_words) * 100
 
     return round(score, 2)
 
 
 def test_calculate_yellow_press_rate():
-    assert -0.01 < calculate_yellow_press_rate([], []) < 0.01
+    assert -0.01 < calculate_yellow_press_rate([], frozenset()) < 0.01
     assert (
         33.0
         < calculate_yellow_press_rate(
-            ['все', 'аутсайдер', 'побег'], ['аутсайдер', 'банкротство']
+            ['все', 'аутсайдер', 'побег'],
+            frozenset(['аутсайдер', 'банкротство']),
         )
         < 34.0
     )